@@ -1,3 +1,5 @@
+import logging
+import selectors
 import socket
 import struct
 import threading
@@ -8,64 +10,129 @@ from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
 
 MODBUS_PORT = 502
 HTTP_PORT = 8001
+
+_LOGGER = logging.getLogger("igusd1.emulator")
+
+# Заранее скомпилированные форматы — без повторного парсинга строк формата
+_PACK_U16 = struct.Struct('<H').pack
+_PACK_I32 = struct.Struct('<i').pack
 import time
 import threading
 
 class ClientRegistry:
+    __slots__ = ('lock', 'clients', '_cached_json', '_cache_deadline')
+
     def __init__(self):
         self.lock = threading.Lock()
         self.clients = {}  # {id: {'type': 'modbus'/'ws'/'http', 'address': str, 'status': 'online'/'offline', ...}}
+        # Кеш сериализованного ответа /clients; сбрасывается при изменениях
+        # и по дедлайну ближайшего перехода online → offline
+        self._cached_json = None
+        self._cache_deadline = 0.0
 
     def update(self, client_id, **kwargs):
         with self.lock:
             self.clients.setdefault(client_id, {})
             self.clients[client_id].update(kwargs)
+            # last_seen — wall clock для отображения, seen_mono — для таймаутов
             self.clients[client_id]['last_seen'] = time.time()
+            self.clients[client_id]['seen_mono'] = time.monotonic()
+            self._cached_json = None
 
     def remove(self, client_id):
         with self.lock:
             if client_id in self.clients:
                 self.clients[client_id]['status'] = 'offline'
                 self.clients[client_id]['last_seen'] = time.time()
+                self.clients[client_id]['seen_mono'] = time.monotonic()
+                self._cached_json = None
+
+    def _snapshot_locked(self, now):
+        # Считаем "offline", если давно не обновлялся; заодно вычисляем,
+        # когда ближайший online-клиент может протухнуть
+        deadline = now + 1.0
+        out = []
+        for cid, info in self.clients.items():
+            status = info.get('status', 'offline')
+            if status == 'online':
+                stale_at = info['seen_mono'] + 5
+                if now > stale_at:
+                    status = 'offline'
+                else:
+                    deadline = min(deadline, stale_at)
+            out.append({
+                'id': cid,
+                'type': info.get('type', 'unknown'),
+                'address': info.get('address', ''),
+                'status': status,
+                'last_seen': info['last_seen']
+            })
+        return out, deadline
 
     def all(self):
         with self.lock:
-            # Считаем "offline", если давно не обновлялся
-            now = time.time()
-            out = []
-            for cid, info in self.clients.items():
-                status = info.get('status', 'offline')
-                if status == 'online' and now - info['last_seen'] > 5:
-                    status = 'offline'
-                out.append({
-                    'id': cid,
-                    'type': info.get('type', 'unknown'),
-                    'address': info.get('address', ''),
-                    'status': status,
-                    'last_seen': info['last_seen']
-                })
-            return out
+            return self._snapshot_locked(time.monotonic())[0]
+
+    def all_json(self):
+        with self.lock:
+            now = time.monotonic()
+            if self._cached_json is not None and now < self._cache_deadline:
+                return self._cached_json
+            out, deadline = self._snapshot_locked(now)
+            self._cached_json = json.dumps(out).encode('utf-8')
+            self._cache_deadline = deadline
+            return self._cached_json
 
 CLIENTS = ClientRegistry()
 
+# Имя бита статусворда → номер бита (CiA-402)
+_SW_BITS = (
+    ('rswon', 0),   # Ready to switch on
+    ('swon', 1),    # Switched on
+    ('eo', 2),      # Operation enabled
+    ('fault', 3),   # Fault
+    ('ve', 4),      # Voltage enabled
+    ('qs', 5),      # Quick stop
+    ('swod', 6),    # Switch on disabled
+    ('warn', 7),    # Warning
+    ('na', 8),      # Not used
+    ('re', 9),      # Remote
+    ('tr', 10),     # Target reached
+    ('ila', 11),    # Internal limit active
+    ('oms', 12),    # OpModeSpecific
+)
+
+
+def _sw_bit_property(bit):
+    """Именованный доступ к одному биту упакованного statusword."""
+    mask = 1 << bit
+
+    def getter(self):
+        return (self._sw >> bit) & 1
+
+    def setter(self, value):
+        if value & 1:
+            self._sw |= mask
+        else:
+            self._sw &= ~mask
+
+    return property(getter, setter)
+
+
 class FakeDriveState:
+    __slots__ = (
+        '_sw',
+        '_pos', 'target_position', 'velocity', 'acceleration',
+        'homed', 'mode', 'is_moving', 'emergency_active',
+        '_move_p0', '_move_p1', '_move_t0', '_move_duration', '_homing',
+        '_state_version', '_cv',
+    )
+
     def __init__(self):
-        # Statusword bits
-        self.rswon = 1    # Ready to switch on
-        self.swon = 0     # Switched on
-        self.eo = 0       # Operation enabled
-        self.fault = 0    # Fault
-        self.ve = 0       # Voltage enabled
-        self.qs = 1       # Quick stop
-        self.swod = 0     # Switch on disabled
-        self.warn = 0     # Warning
-        self.na = 0       # Not used
-        self.re = 1       # Remote
-        self.tr = 1       # Target reached
-        self.ila = 0      # Internal limit active
-        self.oms = 0      # OpModeSpecific
+        # Statusword одним числом: rswon | qs | re | tr
+        self._sw = 0x0621
         # Эмуляция других OD
-        self.position = 0
+        self._pos = 0
         self.target_position = 0
         self.velocity = 0
         self.acceleration = 0
@@ -73,45 +140,66 @@ class FakeDriveState:
         self.mode = 1
         self.is_moving = False
         self.emergency_active = False
-        self._task_lock = threading.Lock()
-
-        self._move_thread = None  # сохраним поток для прерывания
+        # Параметры текущего движения: позиция интерполируется лениво
+        # по monotonic-времени, фоновых потоков больше нет
+        self._move_p0 = 0
+        self._move_p1 = 0
+        self._move_t0 = 0.0
+        self._move_duration = 0.0
+        self._homing = False
+        # Версия состояния: растёт при каждой мутации, чтобы читатели
+        # (SSE) могли кешировать сериализованный снимок и спать до изменения
+        self._state_version = 0
+        self._cv = threading.Condition()
+
+    def _bump(self):
+        with self._cv:
+            self._state_version += 1
+            self._cv.notify_all()
+
+    @property
+    def position(self):
+        self._advance()
+        return self._pos
+
+    @position.setter
+    def position(self, value):
+        self._pos = value
+
+    def _advance(self):
+        """Досчитать позицию текущего движения по monotonic-часам."""
+        if not self.is_moving:
+            return
+        elapsed = time.monotonic() - self._move_t0
+        if elapsed >= self._move_duration:
+            # движение завершено
+            if self._homing:
+                self._pos = 0
+                self.homed = 1
+                self.rswon = 1
+                self.swon = 1
+                self.eo = 1
+                self.ve = 1
+            else:
+                self._pos = self._move_p1
+            self.velocity = 0
+            self.acceleration = 0
+            self.tr = 1
+            self.is_moving = False
+            self._bump()
+        elif not self._homing:
+            frac = elapsed / self._move_duration
+            self._pos = int(self._move_p0 + (self._move_p1 - self._move_p0) * frac)
 
     def set_statusword(self, status_bytes):
         """Установить статусворд по байтам [lsb, msb]."""
-        sw = status_bytes[0] | (status_bytes[1] << 8)
-        self.rswon = (sw >> 0) & 1
-        self.swon  = (sw >> 1) & 1
-        self.eo    = (sw >> 2) & 1
-        self.fault = (sw >> 3) & 1
-        self.ve    = (sw >> 4) & 1
-        self.qs    = (sw >> 5) & 1
-        self.swod  = (sw >> 6) & 1
-        self.warn  = (sw >> 7) & 1
-        self.na    = (sw >> 8) & 1
-        self.re    = (sw >> 9) & 1
-        self.tr    = (sw >> 10) & 1
-        self.ila   = (sw >> 11) & 1
-        self.oms   = (sw >> 12) & 1
+        self._sw = status_bytes[0] | (status_bytes[1] << 8)
+        self._bump()
 
     def make_statusword(self):
-        value = (
-            (self.rswon & 1) << 0  |
-            (self.swon & 1)  << 1  |
-            (self.eo & 1)    << 2  |
-            (self.fault & 1) << 3  |
-            (self.ve & 1)    << 4  |
-            (self.qs & 1)    << 5  |
-            (self.swod & 1)  << 6  |
-            (self.warn & 1)  << 7  |
-            (self.na & 1)    << 8  |
-            (self.re & 1)    << 9  |
-            (self.tr & 1)    << 10 |
-            (self.ila & 1)   << 11 |
-            (self.oms & 1)   << 12
-        )
-        return value
-    
+        return self._sw
+
+
     def move_to(self):
         if self.position == self.target_position:
             self.is_moving = False
@@ -122,45 +210,24 @@ class FakeDriveState:
         if self.emergency_active:
             return
 
-        # пытаемся занять лок
-        if not self._task_lock.acquire(blocking=False):
+        if self.is_moving:
             # другая задача уже выполняется
             return
 
+        self._move_p0 = self._pos
+        self._move_p1 = self.target_position
+        self._move_t0 = time.monotonic()
+        self._move_duration = 5.0
+        self._homing = False
         self.is_moving = True
         self.tr = 0
-
-        def run():
-            try:
-                self._move_simulation()
-            finally:
-                self._task_lock.release()  # освободить лок
-
-        t = threading.Thread(target=run, daemon=True)
-        self._move_thread = t
-        t.start()
-
-
-    def _move_simulation(self):
-        start_pos = self.position
-        end_pos = self.target_position
-        duration = 5.0
-        steps = 1000
-        step_time = duration / steps
-        for i in range(steps):
-            if self.emergency_active:  # остановка
-                break
-            self.position = int(start_pos + (end_pos - start_pos) * (i + 1) / steps)
-            time.sleep(step_time)
-        self.velocity = 0
-        self.acceleration = 0
-        self.tr = 1
-        self.is_moving = False
+        self._bump()
 
     def emergency_stop(self, active: bool):
-        self.emergency_active = active
         if active:
-            # Останавливаем движение
+            # Останавливаем движение: зафиксировать текущую позицию
+            self._advance()
+            self.emergency_active = True
             self.is_moving = False
             self.velocity = 0
             # Сбрасываем рабочие биты
@@ -170,133 +237,154 @@ class FakeDriveState:
             self.fault = 1  # в аварийном состоянии
             self.tr = 0
         else:
+            self.emergency_active = False
             # Сбрасываем fault, но оставляем состояние FAULT
             # Пока пользователь не пошлёт 0x80 (Fault reset)
             self.fault = 1
+        self._bump()
+
     def do_home(self):
         if self.emergency_active:
             return
 
-        if not self._task_lock.acquire(blocking=False):
+        if self.is_moving:
             return
 
+        # Позиция «стоит» до конца хоминга и сбрасывается в ноль по завершении
+        self._move_p0 = self._pos
+        self._move_p1 = self._pos
+        self._move_t0 = time.monotonic()
+        self._move_duration = 5.0
+        self._homing = True
         self.is_moving = True
         self.tr = 0
+        self._bump()
 
-        def run():
-            try:
-                self._home_simulation()
-            finally:
-                self._task_lock.release()
-
-        threading.Thread(target=run, daemon=True).start()
-
-    def _home_simulation(self):
-        duration = 5.0
-        steps = 100
-        step_time = duration / steps
-        for _ in range(steps):
-            time.sleep(step_time)
-        self.position = 0
-        self.homed = 1
-        self.tr = 1
+    def sdo_read(self, index, subindex):
+        self._advance()
+        idx = index[1] | (index[0] << 8)
+        handler = READ_HANDLERS.get(idx)
+        if handler is None:
+            return bytes([0, 0])
+        return handler(self)
+
+    # === Обработчики controlword (0x6040) ===
+
+    def _cw_fault_reset(self):  # 0x80
+        self.fault = 0
+        self.is_moving = False
+        self.velocity = 0
+        # Statusword: только rswon = 1, остальные 0
+        self.rswon = 1; self.swon = self.eo = self.ve = self.tr = self.warn = 0
+
+    def _cw_fault(self):  # 0x08
+        self.fault = 1
         self.is_moving = False
+        self.velocity = 0
+        self.eo = self.swon = self.ve = 0
+
+    def _cw_shutdown(self):  # 0x06
+        self.rswon = 1
+        self.qs = 1         # <--- ВАЖНО!
+        self.swon = self.eo = self.ve = self.tr = 0
+        self.fault = 0
+
+    def _cw_switch_on(self):  # 0x07
+        self.rswon = 1
+        self.swon = 1
+        self.qs = 1         # <--- ВАЖНО!
+        self.eo = self.ve = self.tr = 0
+        self.fault = 0
+
+    def _cw_enable_operation(self):  # 0x0F
         self.rswon = 1
         self.swon = 1
         self.eo = 1
+        self.qs = 1         # <--- ВАЖНО!
         self.ve = 1
+        self.tr = 1 if not self.is_moving else 0
+        self.fault = 0
 
-    def sdo_read(self, index, subindex):
-        idx = index[1] | (index[0] << 8)
-        if idx == 0x6041:  # Statusword
-            sw = self.make_statusword()
-            return struct.pack('<H', sw)
-        if idx == 0x2014:  # Statusword
-            return bytes([self.homed, 0])
-        if idx == 0x6064:  # Position (int32)
-            return struct.pack('<i', self.position)
-        if idx == 0x606C:  # Velocity (int32)
-            return struct.pack('<i', self.velocity)
-        if idx == 0x6083:  # Velocity (int32)
-            return struct.pack('<i', self.acceleration)
-        if idx == 0x6098:  # Homing status (uint8)
-            return bytes([self.homed])
-        return bytes([0, 0])
+    def _cw_disable(self):  # 0x00
+        self.eo = 0
+        self.swon = 0
+        self.ve = 0
+
+    def _cw_start_motion(self):  # 31 — новая уставка / старт хоминга
+        self.tr = 0
+        if self.mode == 6:
+            self.do_home()
+        if self.mode == 1:
+            self.move_to()
 
     def sdo_write(self, index, subindex, value):
+        self._advance()
         idx = index[1] | (index[0] << 8)
         if self.emergency_active:
             return
+        self._bump()
         if idx == 0x6040:  # Controlword — команда
-            if value == 0x80:  # Fault Reset
-                self.fault = 0
-                self.is_moving = False
-                self.velocity = 0
-                # Statusword: только rswon = 1, остальные 0
-                self.rswon = 1; self.swon = self.eo = self.ve = self.tr = self.warn = 0
-            elif value == 0x08:  # FAULT
-                self.fault = 1
-                self.is_moving = False
-                self.velocity = 0
-                self.eo = self.swon = self.ve = 0
-            elif value == 0x06:  # Shutdown
-                self.rswon = 1
-                self.qs = 1         # <--- ВАЖНО!
-                self.swon = self.eo = self.ve = self.tr = 0
-                self.fault = 0
+            handler = CONTROLWORD_HANDLERS.get(value)
+            if handler is not None:
+                handler(self)
+        else:
+            field = WRITE_FIELDS.get(idx)
+            if field is not None:
+                setattr(self, field, int(value))
+
+
+for _name, _bit in _SW_BITS:
+    setattr(FakeDriveState, _name, _sw_bit_property(_bit))
+
+
+# Диспетчеризация SDO по индексу OD: один hash-lookup вместо цепочки if/elif
+READ_HANDLERS = {
+    0x6041: lambda s: _PACK_U16(s.make_statusword()),   # Statusword
+    0x2014: lambda s: bytes([s.homed, 0]),              # Homing flag (u16)
+    0x6064: lambda s: _PACK_I32(s.position),            # Position (int32)
+    0x606C: lambda s: _PACK_I32(s.velocity),            # Velocity (int32)
+    0x6083: lambda s: _PACK_I32(s.acceleration),        # Acceleration (int32)
+    0x6098: lambda s: bytes([s.homed]),                 # Homing status (uint8)
+}
+
+CONTROLWORD_HANDLERS = {
+    0x80: FakeDriveState._cw_fault_reset,
+    0x08: FakeDriveState._cw_fault,
+    0x06: FakeDriveState._cw_shutdown,
+    0x07: FakeDriveState._cw_switch_on,
+    0x0F: FakeDriveState._cw_enable_operation,
+    0x00: FakeDriveState._cw_disable,
+    31:   FakeDriveState._cw_start_motion,
+}
+
+# Простые записи OD → имя поля
+WRITE_FIELDS = {
+    0x6060: 'mode',             # Mode of Operation
+    0x607A: 'target_position',  # Target position
+    0x6081: 'velocity',         # Profile velocity
+    0x6083: 'acceleration',     # Profile acceleration
+    0x6098: 'homed',            # Homing method (используется как флаг)
+}
+
+
+# Заголовок запроса одним декодом: tid@1, cmd@9, index@12..13, subindex@14, length@18
+_REQ_HDR = struct.Struct('<xB7xB2xBBB3xB')
+_UNPACK_U32 = struct.Struct('<I').unpack_from
+_UNPACK_U16 = struct.Struct('<H').unpack_from
 
-            elif value == 0x07:  # Switch On
-                self.rswon = 1
-                self.swon = 1
-                self.qs = 1         # <--- ВАЖНО!
-                self.eo = self.ve = self.tr = 0
-                self.fault = 0
-            elif value == 0x0F:  # Enable operation
-                self.rswon = 1
-                self.swon = 1
-                self.eo = 1
-                self.qs = 1         # <--- ВАЖНО!
-                self.ve = 1
-                self.tr = 1 if not self.is_moving else 0
-                self.fault = 0
-            # Shutdown
-            elif value == 0x00:
-                self.eo = 0
-                self.swon = 0
-                self.ve = 0
-
-            elif value == 31:
-                self.tr = 0
-                if self.mode == 6:
-                    self.do_home()
-                if self.mode == 1:
-                    self.move_to()
-        elif idx == 0x6060:  # Mode of Operation
-            self.mode = value
-        elif idx == 0x607A:  # Target position
-            self.target_position = int(value)
-        elif idx == 0x6081:  # Target position
-            self.velocity = int(value)
-        elif idx == 0x6083:  # Target position
-            self.acceleration = int(value)
-        elif idx == 0x6098:  # Homed
-            self.homed = value
 
 def parse_modbus_request(data):
     if len(data) < 19:
         return None
-    tid = data[1]
-    cmd = data[9]
+    tid, cmd, _, _, subindex, length = _REQ_HDR.unpack_from(data)
     index = data[12:14]
-    subindex = data[14]
-    length = data[18]
     if cmd == 0:  # SDO READ
         return ("read", tid, index, subindex, None, length)
     if cmd == 1:  # SDO WRITE
         if length == 4:
-            value = struct.unpack("<I", bytes(data[19:23]))[0]
+            value = _UNPACK_U32(data, 19)[0]
         elif length == 2:
-            value = struct.unpack("<H", bytes(data[19:21]))[0]
+            value = _UNPACK_U16(data, 19)[0]
         elif length == 1:
             value = data[19]
         else:
@@ -304,11 +392,13 @@ def parse_modbus_request(data):
         return ("write", tid, index, subindex, value, length)
     return None
 
+_RESP_HDR = struct.Struct('<19B')
+
+
 def make_sdo_response(tid, index, subindex, value_bytes, read=True):
     length = len(value_bytes)
-    mbap = [0, tid, 0, 0, 0, 13+length, 0, 43, 13, 0, 0, 0, index[0], index[1], 0, 0, 0, 0, length]
-    mbap.extend(value_bytes)
-    return mbap
+    return _RESP_HDR.pack(0, tid, 0, 0, 0, 13 + length, 0, 43, 13, 0, 0, 0,
+                          index[0], index[1], 0, 0, 0, 0, length) + bytes(value_bytes)
 
 fakeDrive = FakeDriveState()
 
@@ -329,18 +419,40 @@ class EmulatorHTTPRequestHandler(SimpleHTTPRequestHandler):
             self.send_header('Content-Type', 'application/json')
             self.send_header('Cache-Control', 'no-cache')
             self.end_headers()
-            self.wfile.write(json.dumps(CLIENTS.all()).encode('utf-8'))
+            self.wfile.write(CLIENTS.all_json())
             return
         if self.path == '/events':
             self.send_response(200)
             self.send_header('Content-Type', 'text/event-stream')
             self.send_header('Cache-Control', 'no-cache')
             self.end_headers()
+            # Сокет ответа читаемым не бывает (мы только шлём события) —
+            # readability означает FIN/RST от закрывшейся вкладки
+            poller = selectors.DefaultSelector()
+            poller.register(self.connection, selectors.EVENT_READ)
             try:
+                last_version = None
+                payload = b''
                 while True:
+                    if poller.select(0):
+                        break
+                    # Читаем позицию первой: это продвигает ленивое движение,
+                    # поэтому дальнейшие поля согласованы
+                    position = fakeDrive.position
+                    version = fakeDrive._state_version
+                    if version == last_version and not fakeDrive.is_moving:
+                        # Состояние не менялось — heartbeat кешированными
+                        # байтами и сон до следующего изменения
+                        self.wfile.write(payload)
+                        self.wfile.flush()
+                        with fakeDrive._cv:
+                            fakeDrive._cv.wait_for(
+                                lambda: fakeDrive._state_version != last_version,
+                                timeout=1.0)
+                        continue
 
                     result = {
-                        'position': fakeDrive.position,
+                        'position': position,
                         'target_position': fakeDrive.target_position,
                         'velocity': fakeDrive.velocity,
                         'acceleration': fakeDrive.acceleration,
@@ -362,13 +474,16 @@ class EmulatorHTTPRequestHandler(SimpleHTTPRequestHandler):
                         'ila': fakeDrive.ila,
                         'oms': fakeDrive.oms
                     }
-                    data = json.dumps(result)
+                    payload = b'data: ' + json.dumps(result).encode('utf-8') + b'\n\n'
+                    last_version = version
 
-                    self.wfile.write(f'data: {data}\n\n'.encode('utf-8'))
+                    self.wfile.write(payload)
                     self.wfile.flush()
                     time.sleep(0.05)
             except Exception:
                 pass
+            finally:
+                poller.close()
         else:
             super().do_GET()
 
@@ -390,7 +505,7 @@ def start_http_server():
     handler = EmulatorHTTPRequestHandler
     server = ThreadingHTTPServer(('0.0.0.0', HTTP_PORT), handler)
     threading.Thread(target=server.serve_forever, daemon=True).start()
-    print(f'HTTP server started at http://0.0.0.0:{HTTP_PORT}')
+    _LOGGER.info("HTTP server started at http://0.0.0.0:%s", HTTP_PORT)
 
 import threading
 
@@ -398,63 +513,86 @@ client_counter = 0  # глобальный счётчик для присвое
 modbus_client_lock = threading.Lock()
 current_modbus_client = None  # хранит адрес текущего клиента (host, port)
 
-def http_handle_client(conn, state: FakeDriveState):
+MODBUS_IDLE_TIMEOUT = 60.0
+
+
+async def modbus_handle_client(reader, writer):
     global current_modbus_client
-    client_addr = conn.getpeername()
+    client_addr = writer.get_extra_info('peername')
     client_id = f"modbus:{client_addr[0]}:{client_addr[1]}"
 
+    # Мёртвый/полуоткрытый клиент не должен навсегда занимать
+    # единственный Modbus-слот: keepalive + конечный таймаут чтения
+    sock = writer.get_extra_info('socket')
+    if sock is not None:
+        # Nagle задерживает маленькие SDO-ответы до ~40 мс — выключаем
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+
     # === Только один клиент ===
     acquired = modbus_client_lock.acquire(blocking=False)
     if not acquired:
         # Уже есть соединение — отправляем ошибку и закрываем
         try:
-            # Можно отправить кастомное сообщение об ошибке (по TCP — текст, либо Modbus exception, если хочется заморочиться)
-            msg = b"Modbus server busy: only one client allowed\n"
-            conn.send(msg)
+            writer.write(b"Modbus server busy: only one client allowed\n")
+            await writer.drain()
         except Exception:
             pass
-        conn.close()
-        print(f"[Modbus] Refused second connection from {client_addr} — already in use.")
+        writer.close()
+        _LOGGER.warning("[Modbus] Refused second connection from %s — already in use.", client_addr)
         return
     current_modbus_client = client_addr
     CLIENTS.update(client_id, type='modbus', address=f"{client_addr[0]}:{client_addr[1]}", status='online')
 
+    state = fakeDrive
     try:
         while True:
             try:
-                data = conn.recv(24)
-            except ConnectionResetError:
-                print(f"[Modbus] Client forcibly closed connection ({client_addr})")
+                # Кадрирование по MBAP: 6 байт заголовка, длина в байтах 4..5,
+                # затем дочитываем остаток ADU — один ADU не обязан приходить
+                # одним сегментом, и сегмент может нести несколько ADU
+                header = await asyncio.wait_for(reader.readexactly(6), MODBUS_IDLE_TIMEOUT)
+                adu_len = (header[4] << 8) | header[5]
+                if adu_len == 0 or adu_len > 250:
+                    _LOGGER.warning("[Modbus] Bad ADU length %s from %s, dropping connection",
+                                    adu_len, client_addr)
+                    break
+                body = await asyncio.wait_for(reader.readexactly(adu_len), MODBUS_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                _LOGGER.info("[Modbus] Client %s idle too long, dropping connection", client_addr)
                 break
-
-            if not data:
+            except (asyncio.IncompleteReadError, ConnectionResetError):
+                _LOGGER.debug("[Modbus] Client closed connection (%s)", client_addr)
                 break
+
             CLIENTS.update(client_id, status='online')
-            req = parse_modbus_request(list(data))
+            req = parse_modbus_request(header + body)
             if not req:
                 continue
             op, tid, index, subindex, value, _ = req
             if op == "read":
-                val_bytes = fakeDrive.sdo_read(index, subindex)
-                resp = make_sdo_response(tid, index, subindex, list(val_bytes))
+                resp = make_sdo_response(tid, index, subindex, state.sdo_read(index, subindex))
             elif op == "write":
-                fakeDrive.sdo_write(index, subindex, value)
-                sw = fakeDrive.make_statusword()
-                lsb = sw & 0xFF
-                msb = (sw >> 8) & 0xFF
-                pair = [lsb, msb]
-                resp = make_sdo_response(tid, index, subindex, pair)
+                state.sdo_write(index, subindex, value)
+                resp = make_sdo_response(tid, index, subindex, _PACK_U16(state.make_statusword()))
             else:
-                resp = [0]*24
-            resp[1] = tid
-            conn.send(bytes(resp))
+                resp = bytes(24)
+            try:
+                writer.write(resp)
+                await writer.drain()
+            except ConnectionResetError:
+                break
     finally:
-        conn.close()
+        writer.close()
         CLIENTS.remove(client_id)
         # Освобождаем lock — можно принимать следующего клиента!
         modbus_client_lock.release()
         current_modbus_client = None
-        print(f"[Modbus] Disconnected client {client_addr}, slot freed.")
+        _LOGGER.info("[Modbus] Disconnected client %s, slot freed.", client_addr)
 
 
 # import random
@@ -526,7 +664,7 @@ import socket
 import threading
 
 async def ws_handler(websocket):
-    print("Client connected")
+    _LOGGER.info("WebSocket client connected")
     try:
         while True:
             try:
@@ -537,19 +675,9 @@ async def ws_handler(websocket):
                 # За 1 секунду ничего не пришло — отправим heartbeat
                 await websocket.send(b'\x00')
     except websockets.exceptions.ConnectionClosed:
-        print("Client disconnected")
+        _LOGGER.info("WebSocket client disconnected")
 
 
-def start_modbus_server():
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    s.bind(("0.0.0.0", MODBUS_PORT))
-    s.listen(5)
-    print(f"Emulator started at 0.0.0.0:{MODBUS_PORT}")
-    while True:
-        conn, addr = s.accept()
-        threading.Thread(target=http_handle_client, args=(conn, fakeDrive), daemon=True).start()
-
 async def main():
     # Стартуем WebSocket серверы (запускаются и живут всё время!)
     servers = await asyncio.gather(
@@ -558,15 +686,19 @@ async def main():
         websockets.serve(ws_handler, "0.0.0.0", 9998),
         websockets.serve(ws_handler, "0.0.0.0", 9997),
     )
-    print("All WebSocket servers started")
+    _LOGGER.info("All WebSocket servers started")
+
+    # Modbus-сервер живёт в том же event loop — поток-на-клиента больше не нужен
+    await asyncio.start_server(modbus_handle_client, "0.0.0.0", MODBUS_PORT)
+    _LOGGER.info("Emulator started at 0.0.0.0:%s", MODBUS_PORT)
 
-    # Запускаем HTTP и Modbus серверы в отдельных потоках
+    # HTTP (статика + SSE) остаётся в отдельном потоке
     threading.Thread(target=start_http_server, daemon=True).start()
-    threading.Thread(target=start_modbus_server, daemon=True).start()
 
     # Держим event loop активным
     while True:
         await asyncio.sleep(3600)
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
     asyncio.run(main())
\ No newline at end of file